@@ -2,10 +2,17 @@ import logging
 import json
 import time
 import os
+import warnings
+import uuid
 from datetime import datetime
 from collections import defaultdict, deque
-from flask import Flask, render_template, redirect, url_for, request, jsonify
+from tempfile import SpooledTemporaryFile
+from flask import Flask, Request, render_template, redirect, url_for, request, jsonify
 from PIL import Image
+from werkzeug.exceptions import RequestEntityTooLarge
+import static_assets
+import similarity
+import profiling
 
 try:
     import predict
@@ -15,11 +22,39 @@ except Exception as e:
     PREDICT_AVAILABLE = False
 
 
-app = Flask(__name__)
-
 # Configuration
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+MULTIPART_OVERHEAD = 64 * 1024  # Room for multipart headers and boundaries
+SPOOL_MAX_SIZE = 1024 * 1024  # Uploads above 1MB spill from memory to a temp file
+MAX_IMAGE_PIXELS = 40_000_000  # Reject decompression bombs before decoding
+DEFAULT_SIMILAR_CASES = 5
+MAX_SIMILAR_CASES = 50
+
+# Leading bytes of every format we accept, mapped to the PIL format name
+IMAGE_SIGNATURES = {
+    b'\x89PNG\r\n\x1a\n': 'PNG',
+    b'\xff\xd8\xff': 'JPEG',
+}
+SIGNATURE_LENGTH = max(len(signature) for signature in IMAGE_SIGNATURES)
+
+# Make PIL refuse oversized images while parsing the header instead of warning
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+warnings.simplefilter('error', Image.DecompressionBombWarning)
+
+
+class UploadRequest(Request):
+    """Request that spools uploaded files into a bounded in-memory buffer"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode='rb+')
+
+
+app = Flask(__name__)
+app.request_class = UploadRequest
+# Werkzeug rejects bodies whose Content-Length exceeds this before reading them,
+# and stops streaming bodies without a Content-Length once they cross it
+app.config['MAX_CONTENT_LENGTH'] = MAX_FILE_SIZE + MULTIPART_OVERHEAD
 
 # In-memory storage for analytics and feedback
 analytics_data = {
@@ -41,36 +76,119 @@ analytics_data = {
 with open("static/disease_data.json") as file:
     disease_data = json.load(file)
 
+# Each disease's info block is encoded once and spliced into /analyze responses
+disease_info_json = {
+    disease: json.dumps(info, separators=(',', ':')).encode()
+    for disease, info in disease_data.items()
+}
+
+# Static files are served from memory, precompressed, behind content-hashed URLs
+static_assets.init_app(app)
+index_page = None  # Rendered on first request, once url_for can build versioned URLs
+
+# Opt-in sampling profiler with per-stage spans, controlled through /admin/profile
+profiling.init_app(app)
+
+# Nearest-neighbour index over training images and past analyses, shared by all workers
+similar_cases = None
+if PREDICT_AVAILABLE and predict.EMBEDDING_DIM:
+    try:
+        similar_cases = similarity.EmbeddingIndex(similarity.INDEX_DIR, predict.EMBEDDING_DIM)
+    except Exception as e:
+        logging.error(f"Similar-case index at '{similarity.INDEX_DIR}' not available, "
+                      f"/similar and duplicate checks are off: {e}")
+
 
 def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def sniff_image_format(file):
+    """Return the image format named by the file's magic bytes, or None"""
+    header = file.stream.read(SIGNATURE_LENGTH)
+    file.stream.seek(0)
+    for signature, image_format in IMAGE_SIGNATURES.items():
+        if header.startswith(signature):
+            return image_format
+    return None
+
 def validate_image(file):
-    """Validate uploaded image file"""
+    """Validate uploaded image file and open it lazily for preprocessing
+
+    Returns (image, error_msg). Only the image header is parsed here; the pixel
+    data is decoded later by predict.preprocess_image straight from the
+    spooled upload buffer.
+    """
     if not file or file.filename == '':
-        return False, "No file selected"
+        return None, "No file selected"
     
     if not allowed_file(file.filename):
-        return False, "Invalid file type. Please upload JPG or PNG images only."
+        return None, "Invalid file type. Please upload JPG or PNG images only."
     
-    # Check file size
-    file.seek(0, 2)  # Seek to end
-    file_size = file.tell()
-    file.seek(0)  # Reset to beginning
+    # Check file size; the body is already capped by MAX_CONTENT_LENGTH, so this
+    # only seeks within the bounded spool buffer
+    file.stream.seek(0, 2)  # Seek to end
+    file_size = file.stream.tell()
+    file.stream.seek(0)  # Reset to beginning
     
     if file_size > MAX_FILE_SIZE:
-        return False, "File too large. Maximum size is 10MB."
+        return None, "File too large. Maximum size is 10MB."
     
-    # Validate it's actually an image
+    # Check the magic bytes rather than trusting the extension or mimetype
+    image_format = sniff_image_format(file)
+    if image_format is None:
+        return None, "Invalid file type. Please upload JPG or PNG images only."
+    
+    # Validate the header describes an image we are willing to decode
     try:
-        img = Image.open(file)
-        img.verify()
-        file.seek(0)  # Reset after verify
-        return True, None
+        img = Image.open(file.stream, formats=[image_format])
+        return img, None
+    except (Image.DecompressionBombWarning, Image.DecompressionBombError):
+        return None, "Image dimensions too large. Please upload a smaller image."
     except Exception as e:
         logging.error(f"Image validation failed: {e}")
-        return False, "Invalid image file. Please upload a valid image."
+        return None, "Invalid image file. Please upload a valid image."
+
+def find_duplicate(embedding):
+    """Return the indexed case an upload near-duplicates (a repeat or a training image), if any"""
+    if similar_cases is None or embedding is None:
+        return None
+    try:
+        # search() picks up cases other workers and build_index added; empty indexes return []
+        matches = similar_cases.search(embedding, k=1)
+    except Exception as e:
+        logging.error(f"Duplicate lookup failed: {e}")
+        return None
+    if not matches or matches[0][0] < similarity.EMBEDDING_DUPLICATE_SIMILARITY:
+        return None
+    score, record = matches[0]
+    return {
+        'id': record['id'],
+        'source': record.get('source'),
+        'label': record.get('label'),
+        'similarity': round(score, 4)
+    }
+
+def record_case(embedding, prediction, confidence, filename):
+    """Add an analysed image to the similar-case index, returning its case id"""
+    if similar_cases is None or embedding is None:
+        return None
+    case_id = uuid.uuid4().hex
+    try:
+        similar_cases.add(embedding, [{
+            'id': case_id,
+            'source': 'analysis',
+            'label': prediction,
+            'confidence': float(confidence),
+            'filename': filename,
+            'timestamp': datetime.now().isoformat()
+        }])
+        # Re-cluster off the request path once enough cases sit outside the IVF lists
+        similar_cases.train_in_background()
+        return case_id
+    except Exception as e:
+        logging.error(f"Failed to index case: {e}")
+        return None
 
 def update_analytics(prediction, confidence, processing_time, filename):
     """Update in-memory analytics data"""
@@ -130,9 +248,21 @@ def get_all_predictions_mock(img_data):
     predictions.sort(key=lambda x: x['confidence'], reverse=True)
     return predictions
 
+@app.errorhandler(413)
+def request_too_large(e):
+    return jsonify({'error': 'File too large. Maximum size is 10MB.'}), 413
+
 @app.route("/")
 def index():
-    return render_template("index.html")
+    global index_page
+    if index_page is None or app.debug:
+        index_page = static_assets.build_asset(render_template("index.html").encode(), 'text/html')
+    return static_assets.asset_response(app.response_class, index_page)
+
+def build_analysis_response(result, disease_info):
+    """Serialize an analysis result, splicing in a pre-encoded disease info block"""
+    body = json.dumps(result, separators=(',', ':')).encode()
+    return app.response_class(body[:-1] + b',"disease_info":' + disease_info + b'}', mimetype='application/json')
 
 @app.route('/analyze', methods=['POST'])
 def analyze_image():
@@ -142,23 +272,32 @@ def analyze_image():
             return jsonify({'error': 'No image file provided'}), 400
         
         file = request.files['image']
-        is_valid, error_msg = validate_image(file)
+        with profiling.span('validate_image'):
+            image, error_msg = validate_image(file)
         
-        if not is_valid:
+        if image is None:
             return jsonify({'error': error_msg}), 400
         
         start_time = time.time()
         
         if PREDICT_AVAILABLE:
             # Preprocess and predict using your friend's AI model
-            img_data = predict.preprocess_image(file)
-            confidence, prediction = predict.predict(img_data)
+            try:
+                with profiling.span('preprocess_image'):
+                    img_data = predict.preprocess_image(image)
+            except (OSError, SyntaxError, ValueError) as e:
+                logging.error(f"Image decoding failed: {e}")
+                return jsonify({'error': 'Invalid image file. Please upload a valid image.'}), 400
+            # One (possibly TTA-augmented) scoring shared by the prediction and alternatives
+            with profiling.span('predict'):
+                probabilities, embedding = predict.score_image(img_data)
+                confidence, prediction = predict.predict(img_data, probabilities)
             
             # Get all predictions for alternative possibilities
             try:
                 # Try to get all predictions if the function exists
                 if hasattr(predict, 'get_all_predictions'):
-                    all_predictions = predict.get_all_predictions(img_data)
+                    all_predictions = predict.get_all_predictions(img_data, probabilities)
                 else:
                     # Use mock function if not available
                     all_predictions = get_all_predictions_mock(img_data)
@@ -177,26 +316,96 @@ def analyze_image():
         
         # Update analytics
         update_analytics(prediction, confidence, processing_time, file.filename)
+        with profiling.span('similar_cases'):
+            duplicate_of = find_duplicate(embedding)
+            case_id = record_case(embedding, prediction, confidence, file.filename)
         
-        # Get disease information
-        disease_info = disease_data.get(prediction, disease_data.get('unknown'))
-        
-        # Prepare response
-        result = {
-            'success': True,
-            'prediction': prediction,
-            'confidence': float(confidence),
-            'disease_info': disease_info,
-            'alternatives': all_predictions[:3],  # Top 3 alternatives
-            'processing_time_ms': processing_time
-        }
-        
-        return jsonify(result)
+        with profiling.span('build_response'):
+            # Get disease information
+            disease_info = disease_info_json.get(prediction, disease_info_json['unknown'])
             
+            # Prepare response
+            result = {
+                'success': True,
+                'prediction': prediction,
+                'confidence': float(confidence),
+                'alternatives': all_predictions[:3],  # Top 3 alternatives
+                'processing_time_ms': processing_time,
+                'case_id': case_id,
+                'duplicate_of': duplicate_of
+            }
+            
+            return build_analysis_response(result, disease_info)
+            
+    except RequestEntityTooLarge:
+        raise  # Handled by request_too_large
     except Exception as e:
         logging.error(f"Analysis error: {e}")
         return jsonify({'error': 'An error occurred during analysis. Please try again.'}), 500
 
+def similar_cases_response(vector, exclude=()):
+    """Look up the nearest past cases to an embedding and format them as JSON"""
+    try:
+        k = min(max(int(request.args.get('k', DEFAULT_SIMILAR_CASES)), 1), MAX_SIMILAR_CASES)
+    except ValueError:
+        return jsonify({'error': 'k must be an integer'}), 400
+    
+    start_time = time.perf_counter()
+    matches = similar_cases.search(vector, k=k, exclude=exclude)
+    query_time = (time.perf_counter() - start_time) * 1000
+    
+    return jsonify({
+        'success': True,
+        'similar': [{**record, 'similarity': round(score, 4)} for score, record in matches],
+        'indexed_cases': len(similar_cases),
+        'query_time_ms': round(query_time, 2)
+    })
+
+@app.route('/similar', methods=['POST'])
+def similar_to_upload():
+    """Find the past cases most similar to an uploaded image"""
+    try:
+        if similar_cases is None:
+            return jsonify({'error': 'Similar-case search is not available.'}), 503
+        if 'image' not in request.files:
+            return jsonify({'error': 'No image file provided'}), 400
+        
+        image, error_msg = validate_image(request.files['image'])
+        if image is None:
+            return jsonify({'error': error_msg}), 400
+        
+        try:
+            img_data = predict.preprocess_image(image)
+        except (OSError, SyntaxError, ValueError) as e:
+            logging.error(f"Image decoding failed: {e}")
+            return jsonify({'error': 'Invalid image file. Please upload a valid image.'}), 400
+        
+        _, embedding = predict.score_image(img_data, tta=False)
+        return similar_cases_response(embedding)
+    
+    except RequestEntityTooLarge:
+        raise  # Handled by request_too_large
+    except Exception as e:
+        logging.error(f"Similar search error: {e}")
+        return jsonify({'error': 'An error occurred during search. Please try again.'}), 500
+
+@app.route('/similar/<path:case_id>')  # Training cases are keyed by their dataset path
+def similar_to_case(case_id):
+    """Find the past cases most similar to an already analysed or indexed case"""
+    try:
+        if similar_cases is None:
+            return jsonify({'error': 'Similar-case search is not available.'}), 503
+        
+        vector = similar_cases.vector(case_id)
+        if vector is None:
+            return jsonify({'error': 'Unknown case id'}), 404
+        
+        return similar_cases_response(vector, exclude={case_id})
+    
+    except Exception as e:
+        logging.error(f"Similar search error: {e}")
+        return jsonify({'error': 'An error occurred during search. Please try again.'}), 500
+
 @app.route('/health')
 def health_check():
     return jsonify({'status': 'healthy'})
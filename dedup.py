@@ -0,0 +1,86 @@
+import numpy as np
+from collections import defaultdict
+from scipy.fft import dctn
+from PIL import Image
+
+# Two images are near-duplicates when their perceptual hashes differ in at most
+# HASH_DUPLICATE_DISTANCE bits, or their embeddings reach
+# similarity.EMBEDDING_DUPLICATE_SIMILARITY
+HASH_DUPLICATE_DISTANCE = 3
+HASH_BANDS = HASH_DUPLICATE_DISTANCE + 1  # Pigeonhole: a close pair matches exactly in some band
+
+
+def phash(image, hash_size=8, highfreq_factor=4):
+    """64-bit DCT perceptual hash of a PIL image"""
+    size = hash_size * highfreq_factor
+    pixels = np.asarray(image.convert("L").resize((size, size), Image.Resampling.LANCZOS), dtype=np.float32)
+    low_freq = dctn(pixels, norm="ortho")[:hash_size, :hash_size]
+    bits = (low_freq > np.median(low_freq.ravel()[1:])).ravel()  # Median ignores the DC term
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def dhash(image, hash_size=8):
+    """64-bit gradient hash of a PIL image"""
+    pixels = np.asarray(image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS),
+                        dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class HashIndex:
+    """Multi-index hashing over 64-bit hashes
+
+    Each hash is split into HASH_BANDS bands and filed under every band
+    value, so a lookup only compares against hashes sharing a band instead
+    of the whole collection. Any hash within HASH_DUPLICATE_DISTANCE bits
+    shares at least one band exactly, so no near-duplicate is missed.
+    """
+
+    def __init__(self, bands=HASH_BANDS, bits=64):
+        self.band_bits = bits // bands
+        self.bands = [defaultdict(list) for _ in range(bands)]
+        self.hashes = {}
+
+    def _band_values(self, value):
+        mask = (1 << self.band_bits) - 1
+        return [(value >> (band * self.band_bits)) & mask for band in range(len(self.bands))]
+
+    def add(self, key, value):
+        self.hashes[key] = value
+        for band, band_value in zip(self.bands, self._band_values(value)):
+            band[band_value].append(key)
+
+    def query(self, value, max_distance=HASH_DUPLICATE_DISTANCE):
+        """Keys whose hash is within max_distance bits, as (distance, key) pairs"""
+        candidates = set()
+        for band, band_value in zip(self.bands, self._band_values(value)):
+            candidates.update(band.get(band_value, ()))
+        matches = [(hamming(value, self.hashes[key]), key) for key in candidates]
+        return sorted(match for match in matches if match[0] <= max_distance)
+
+
+class DisjointSet:
+    """Union-find used to merge duplicate pairs into clusters"""
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, key):
+        self.parent.setdefault(key, key)
+        while self.parent[key] != key:
+            self.parent[key] = self.parent[self.parent[key]]
+            key = self.parent[key]
+        return key
+
+    def union(self, a, b):
+        self.parent[self.find(a)] = self.find(b)
+
+    def clusters(self):
+        groups = defaultdict(list)
+        for key in self.parent:
+            groups[self.find(key)].append(key)
+        return [sorted(members) for members in groups.values() if len(members) > 1]
@@ -0,0 +1,28 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))  # gunicorn loads this before chdir
+import worker_cpus
+
+# Loaded automatically by gunicorn from the working directory. Worker count
+# still comes from the command line (Procfile: --workers 3).
+#
+# Every worker runs its own TensorFlow runtime, so predict.py sizes the
+# intra/inter-op pools to the worker's share of the CPUs instead of the whole
+# machine. Set PIN_WORKER_CPUS=1 to also pin each worker to its own cores.
+# Do not enable preload_app: TensorFlow must start after the fork.
+PIN_WORKER_CPUS = os.environ.get('PIN_WORKER_CPUS', '0') == '1'
+
+
+def pre_fork(server, worker):
+    # Reuse the CPU group of the worker being replaced so groups stay balanced
+    used = {getattr(w, 'cpu_slot', None) for w in server.WORKERS.values()}
+    free = [slot for slot in range(server.num_workers) if slot not in used]
+    worker.cpu_slot = free[0] if free else worker.age % server.num_workers
+
+
+def post_fork(server, worker):
+    os.environ['GUNICORN_WORKERS'] = str(server.num_workers)
+    if PIN_WORKER_CPUS:
+        group = worker_cpus.pin_worker(worker.cpu_slot, server.num_workers)
+        server.log.info(f"Worker {worker.pid} pinned to CPUs {group}")
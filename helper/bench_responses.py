@@ -0,0 +1,57 @@
+import os
+import re
+import sys
+import time
+from flask import jsonify
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import app
+
+# === CONFIG ===
+# Response bytes and server time per request for the precomputed payloads.
+# Run from the project root: python helper/bench_responses.py
+ITERATIONS = 2000
+
+client = app.app.test_client()
+result = {
+    'success': True,
+    'prediction': 'black_scorch',
+    'confidence': 0.9312,
+    'alternatives': [
+        {'disease': 'black_scorch', 'confidence': 0.9312, 'class_index': 0},
+        {'disease': 'leaf_spots', 'confidence': 0.0411, 'class_index': 3},
+        {'disease': 'rachis_blight', 'confidence': 0.0107, 'class_index': 8},
+    ],
+    'processing_time_ms': 42,
+}
+
+
+def time_per_call(fn):
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        response = fn()
+    return (time.perf_counter() - start) / ITERATIONS * 1e6, response
+
+
+def report(name, fn):
+    micros, response = time_per_call(fn)
+    print(f"{name:44} {response.status_code:>4} {len(response.get_data()):>9} B {micros:>9.1f} us")
+
+
+# === /analyze PAYLOAD ===
+print(f"{'case':44} {'code':>4} {'bytes':>11} {'server time':>12}")
+with app.app.test_request_context():
+    report('analyze: jsonify with disease_info dict',
+           lambda: jsonify({**result, 'disease_info': app.disease_data['black_scorch']}))
+    report('analyze: spliced pre-encoded disease_info',
+           lambda: app.build_analysis_response(result, app.disease_info_json['black_scorch']))
+
+# === PAGE AND STATIC FILES ===
+page = client.get('/').get_data(as_text=True)
+versioned = {os.path.basename(url.split('?')[0]): url for url in re.findall(r'/static/[^"]+\?v=\w+', page)}
+
+for name, url in [('/', '/')] + sorted(versioned.items()):
+    for encoding in ('identity', 'gzip', 'br'):
+        report(f"{name} ({encoding})", lambda: client.get(url, headers={'Accept-Encoding': encoding}))
+    etag = client.get(url).headers['ETag']
+    report(f"{name} (revalidated)", lambda: client.get(url, headers={'If-None-Match': etag}))
@@ -0,0 +1,103 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from similarity import EmbeddingIndex, normalize, NPROBE
+
+# === CONFIG ===
+# Query latency and recall@K of the similarity index per nprobe, against an
+# exact scan. By default on synthetic embeddings shaped like MobileNetV2's
+# pooled output: points on a low-dimensional manifold made of overlapping
+# clusters, so true neighbours often sit in a neighbouring IVF list. With
+# --index, on the real embeddings of an index built by helper/build_index.py.
+# Run from the project root: python helper/bench_similar.py [--index similarity_index]
+N_VECTORS = 100_000
+DIM = 1280
+LATENT_DIM = 16         # intrinsic dimension of the synthetic manifold
+N_CLUSTERS = 50         # overlapping modes (disease x growth stage x lighting...)
+CLUSTER_SPREAD = 1.5    # distance between modes, in units of their own spread
+NOISE = 2.0             # isotropic noise per embedding dimension
+N_QUERIES = 200
+K = 10
+BATCH = 10_000
+NPROBES = (1, 2, 4, 8, 16, 32)
+
+rng = np.random.default_rng(0)
+projection = rng.standard_normal((LATENT_DIM, DIM)).astype(np.float32)
+centres = CLUSTER_SPREAD * rng.standard_normal((N_CLUSTERS, LATENT_DIM)).astype(np.float32)
+
+
+def sample(n):
+    latent = centres[rng.integers(N_CLUSTERS, size=n)] + rng.standard_normal((n, LATENT_DIM)).astype(np.float32)
+    return normalize(latent @ projection + NOISE * rng.standard_normal((n, DIM)).astype(np.float32))
+
+
+def synthetic_index(index_dir):
+    index = EmbeddingIndex(index_dir, DIM)
+    start = time.perf_counter()
+    for offset in range(0, N_VECTORS, BATCH):
+        index.add(sample(BATCH), [{'id': f'case_{offset + i}'} for i in range(BATCH)])
+    print(f"added {len(index)} vectors in {time.perf_counter() - start:.1f} s")
+
+    start = time.perf_counter()
+    index.train()
+    print(f"trained {len(index.centroids)} lists in {time.perf_counter() - start:.1f} s")
+    print(f"on disk: {sum(os.path.getsize(os.path.join(index_dir, f)) for f in os.listdir(index_dir)) / 2**20:.0f} MB")
+    return index, sample(N_QUERIES)
+
+
+def real_queries(index):
+    """Stored embeddings as queries, each excluding itself from its results"""
+    rows = np.random.default_rng(0).choice(len(index), min(N_QUERIES, len(index)), replace=False)
+    return index.vectors[rows].astype(np.float32), [index.meta[row]['id'] for row in rows]
+
+
+def run(index, queries, query_ids, open_index):
+    exact = (index.vectors[:len(index)].astype(np.float32) @ queries.T).T
+
+    def measure(index, nprobe):
+        latencies, recall = [], []
+        for i, (query, scores) in enumerate(zip(queries, exact)):
+            exclude = {query_ids[i]} if query_ids else set()
+            start = time.perf_counter()
+            results = index.search(query, k=K, nprobe=nprobe, exclude=exclude)
+            latencies.append((time.perf_counter() - start) * 1000)
+            nearest = (index.meta[row]['id'] for row in np.argsort(-scores)[:K + len(exclude)])
+            truth = {record_id for record_id in nearest if record_id not in exclude}
+            recall.append(len(truth & {meta['id'] for _, meta in results}) / K)
+        return (f"p50: {np.percentile(latencies, 50):5.2f} ms  p99: {np.percentile(latencies, 99):5.2f} ms  "
+                f"recall@{K}: {np.mean(recall):.3f}")
+
+    if index.centroids is None:
+        print(f"untrained, brute force  {measure(index, NPROBE)}")
+        return
+    sizes = np.diff(index.offsets)
+    print(f"{len(sizes)} lists, rows per list: median {int(np.median(sizes))}, max {sizes.max()}")
+
+    # A fresh process maps the same files instead of loading them
+    start = time.perf_counter()
+    reopened = open_index()
+    print(f"reopened (memory-mapped) in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    for nprobe in NPROBES:
+        print(f"nprobe {nprobe:2}{' (default)' if nprobe == NPROBE else '          '}  {measure(reopened, nprobe)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Similarity index latency and recall")
+    parser.add_argument('--index', help="measure an existing index instead of synthetic embeddings")
+    args = parser.parse_args()
+
+    if args.index:
+        index = EmbeddingIndex(args.index, np.load(os.path.join(args.index, 'vectors.npy'), mmap_mode='r').shape[1])
+        print(f"'{args.index}': {len(index)} vectors")
+        queries, query_ids = real_queries(index)
+        run(index, queries, query_ids, lambda: EmbeddingIndex(args.index, index.dim))
+    else:
+        with tempfile.TemporaryDirectory() as index_dir:
+            index, queries = synthetic_index(index_dir)
+            run(index, queries, (), lambda: EmbeddingIndex(index_dir, DIM))
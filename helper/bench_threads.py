@@ -0,0 +1,103 @@
+import argparse
+import multiprocessing as mp
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import worker_cpus
+
+# Sweeps gunicorn workers x TensorFlow intra-op threads on this machine. Each
+# worker is a separate process running predict.score_image back to back, like
+# a gunicorn worker under full load; reports throughput and latency tails.
+# Run from the project root (needs the .keras model):
+#   python helper/bench_threads.py --workers 1,2,3,4 --threads 1,2,4,auto --pin
+SAMPLE_DIR = 'dataset/diseases/val'
+SAMPLE_IMAGES = 16
+WARMUP = 5
+
+
+def sample_paths():
+    paths = []
+    for root, _, files in sorted(os.walk(SAMPLE_DIR)):
+        paths.extend(os.path.join(root, f) for f in sorted(files) if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+    return paths[::max(1, len(paths) // SAMPLE_IMAGES)][:SAMPLE_IMAGES]
+
+
+def worker(slot, workers, threads, inter_threads, pin, requests, barrier, results):
+    os.environ['GUNICORN_WORKERS'] = str(workers)
+    os.environ['TF_INTRA_OP_THREADS'] = str(threads)
+    os.environ['TF_INTER_OP_THREADS'] = str(inter_threads)
+    if pin:
+        worker_cpus.pin_worker(slot, workers)
+    import predict
+
+    batches = [predict.preprocess_image(path) for path in sample_paths()]
+    for i in range(WARMUP):
+        predict.score_image(batches[i % len(batches)], tta=False)
+
+    barrier.wait()
+    latencies = []
+    for i in range(requests):
+        start = time.perf_counter()
+        predict.score_image(batches[i % len(batches)], tta=False)
+        latencies.append(time.perf_counter() - start)
+    results.put((predict.TF_INTRA_OP_THREADS, predict.TF_INTER_OP_THREADS, latencies))
+
+
+def run(workers, threads, inter_threads, pin, requests):
+    ctx = mp.get_context('spawn')  # Fresh TensorFlow runtime per worker, as after a gunicorn fork
+    barrier = ctx.Barrier(workers + 1)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(slot, workers, threads, inter_threads, pin, requests, barrier, results))
+             for slot in range(workers)]
+    for proc in procs:
+        proc.start()
+    barrier.wait()
+    start = time.perf_counter()
+    outputs = [results.get() for _ in procs]
+    wall = time.perf_counter() - start
+    for proc in procs:
+        proc.join()
+
+    latencies = np.concatenate([output[2] for output in outputs]) * 1000
+    return {
+        'intra': outputs[0][0],
+        'inter': outputs[0][1],
+        'throughput': len(latencies) / wall,
+        'p50': np.percentile(latencies, 50),
+        'p95': np.percentile(latencies, 95),
+        'p99': np.percentile(latencies, 99),
+    }
+
+
+def parse_list(value):
+    return [0 if item == 'auto' else int(item) for item in value.split(',')]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sweep gunicorn workers x TensorFlow threads")
+    parser.add_argument('--workers', type=parse_list, default=[1, 2, 3, 4], help="e.g. 1,2,3,4")
+    parser.add_argument('--threads', type=parse_list, default=[1, 2, 4, 0], help="intra-op threads, e.g. 1,2,auto")
+    parser.add_argument('--inter-threads', type=int, default=0, help="inter-op threads (default: auto)")
+    parser.add_argument('--requests', type=int, default=100, help="requests per worker")
+    parser.add_argument('--pin', action='store_true', help="pin each worker to its own CPU group")
+    args = parser.parse_args()
+
+    print(f"{len(worker_cpus.available_cpus())} CPUs available, pinning {'on' if args.pin else 'off'}")
+    print(f"{'workers':>7} {'intra':>5} {'inter':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    rows = []
+    for workers in args.workers:
+        for threads in args.threads:
+            row = {'workers': workers, **run(workers, threads, args.inter_threads, args.pin, args.requests)}
+            rows.append(row)
+            print(f"{row['workers']:>7} {row['intra']:>5} {row['inter']:>5} {row['throughput']:>8.1f} "
+                  f"{row['p50']:>8.1f} {row['p95']:>8.1f} {row['p99']:>8.1f}")
+
+    best = max(rows, key=lambda row: row['throughput'])
+    tail = min(rows, key=lambda row: row['p99'])
+    print(f"✅ Best throughput: --workers {best['workers']} with TF_INTRA_OP_THREADS={best['intra']} "
+          f"({best['throughput']:.1f} req/s, p99 {best['p99']:.1f} ms)")
+    print(f"✅ Best p99: --workers {tail['workers']} with TF_INTRA_OP_THREADS={tail['intra']} "
+          f"({tail['throughput']:.1f} req/s, p99 {tail['p99']:.1f} ms)")
@@ -0,0 +1,129 @@
+import io
+import os
+import sys
+import types
+import multiprocessing as mp
+import numpy as np
+from PIL import Image, ImageOps
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# === CONFIG ===
+# Peak RSS growth of one worker while it handles a single /analyze request,
+# checked against a per-case bound; exits non-zero if any case fails.
+# Each case runs in a fresh forked process so peaks do not leak between cases.
+# Without tensorflow and a .keras model the model is stubbed, so valid images
+# are still decoded from the spooled upload exactly as predict.py does.
+# Run from the project root: python helper/bench_upload.py
+BOUNDARY = 'palmbench'
+REJECTED_RSS_KB = 4 * 1024   # Rejected uploads never hold more than the spool buffer
+DECODE_FRAME_KB = 2400 * 2400 * 3 // 1024  # One RGB frame of the largest test image
+# Decoding holds the frame and its RGB copy; the upload itself must stay spooled, not in memory
+DECODED_RSS_KB = 3 * DECODE_FRAME_KB
+
+
+def encode(img, fmt, **kwargs):
+    buf = io.BytesIO()
+    img.save(buf, fmt, **kwargs)
+    return buf.getvalue()
+
+
+def build_cases():
+    """(name, filename, payload, send Content-Length, expected status, peak RSS bound in KB)"""
+    noise = Image.frombytes('RGB', (2400, 2400), os.urandom(2400 * 2400 * 3))
+    return [
+        ('small png', 'leaf.png', encode(Image.new('RGB', (640, 480), 'green'), 'PNG'), True, 200, DECODED_RSS_KB),
+        ('large jpeg (~7MB)', 'leaf.jpg', encode(noise, 'JPEG', quality=95), True, 200, DECODED_RSS_KB),
+        ('oversized body (12MB)', 'leaf.jpg', os.urandom(12 * 1024 * 1024), True, 413, REJECTED_RSS_KB),
+        ('oversized, no Content-Length', 'leaf.jpg', os.urandom(12 * 1024 * 1024), False, 413, REJECTED_RSS_KB),
+        ('text renamed to .png', 'leaf.png', b'not an image at all\n' * 50_000, True, 400, REJECTED_RSS_KB),
+        ('truncated jpeg', 'leaf.jpg', encode(noise, 'JPEG', quality=95)[:200_000], True, 400, DECODED_RSS_KB),
+        ('decompression bomb png', 'bomb.png', encode(Image.new('L', (10000, 10000)), 'PNG'), True,
+         400, REJECTED_RSS_KB),
+    ]
+
+
+def stub_predict():
+    """Stand-in for predict.py without tensorflow: the real decode, a constant model"""
+    stub = types.ModuleType('predict')
+    stub.IMAGE_SIZE = (224, 224)
+    stub.EMBEDDING_DIM = 0  # No similar-case index
+    stub.labels = {0: 'unknown'}
+
+    def preprocess_image(image):
+        # Same steps as predict.preprocess_image
+        image = ImageOps.fit(image.convert('RGB'), stub.IMAGE_SIZE, Image.Resampling.LANCZOS)
+        image_array = np.asarray(image, dtype=np.float32)
+        image_array /= 255.0
+        return image_array[np.newaxis]
+
+    stub.preprocess_image = preprocess_image
+    stub.score_image = lambda image_data, tta=None: (np.ones(1, dtype=np.float32), None)
+    stub.predict = lambda image_data, probabilities=None: (1.0, 'unknown')
+    stub.get_all_predictions = lambda image_data, probabilities=None: []
+    return stub
+
+
+def multipart_body(filename, payload):
+    head = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="image"; '
+            f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n').encode()
+    return head + payload + f'\r\n--{BOUNDARY}--\r\n'.encode()
+
+
+def peak_rss_kb():
+    with open('/proc/self/status') as status:
+        for line in status:
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1])
+    return 0
+
+
+def reset_peak_rss():
+    # Writing 5 to clear_refs resets VmHWM to the current RSS (Linux >= 4.0)
+    with open('/proc/self/clear_refs', 'w') as clear_refs:
+        clear_refs.write('5')
+
+
+def run_case(filename, payload, with_length, results):
+    try:
+        import predict  # noqa: F401
+    except Exception:
+        sys.modules['predict'] = stub_predict()
+    import app
+
+    body = multipart_body(filename, payload)
+    builder = EnvironBuilder(path='/analyze', method='POST', input_stream=io.BytesIO(body),
+                             content_type=f'multipart/form-data; boundary={BOUNDARY}',
+                             content_length=len(body))
+    environ = builder.get_environ()
+    if not with_length:
+        del environ['CONTENT_LENGTH']
+        environ['wsgi.input_terminated'] = True
+    del payload
+
+    reset_peak_rss()
+    baseline = peak_rss_kb()
+    _, status, _ = run_wsgi_app(app.app, environ, buffered=True)
+    results.put((status, peak_rss_kb() - baseline))
+
+
+if __name__ == '__main__':
+    ctx = mp.get_context('fork')
+    failures = []
+    print(f"{'case':32} {'status':26} {'peak RSS +KB':>12} {'limit KB':>9}")
+    for name, filename, payload, with_length, expected_status, rss_limit in build_cases():
+        results = ctx.Queue()
+        proc = ctx.Process(target=run_case, args=(filename, payload, with_length, results))
+        proc.start()
+        status, delta = results.get()
+        proc.join()
+        ok = int(status.split()[0]) == expected_status and delta <= rss_limit
+        if not ok:
+            failures.append(name)
+        print(f"{name:32} {status:26} {delta:>12} {rss_limit:>9} {'✅' if ok else f'❌ expected {expected_status}'}")
+
+    if failures:
+        print(f"❌ {len(failures)} case(s) failed: {', '.join(failures)}")
+        sys.exit(1)
+    print("✅ Every upload was handled within its memory bound")
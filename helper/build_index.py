@@ -0,0 +1,62 @@
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import predict
+from similarity import EmbeddingIndex, INDEX_DIR
+
+# === CONFIG ===
+# Adds every training image to the similar-case index (skipping ones already
+# indexed), then re-clusters the IVF lists over training and analysed cases.
+# Run from the project root: python helper/build_index.py
+SOURCE_DIR = 'dataset/diseases/train'   # one subfolder per class
+BATCH_SIZE = 32
+
+index = EmbeddingIndex(INDEX_DIR, predict.EMBEDDING_DIM)
+print(f"index at '{INDEX_DIR}' holds {len(index)} cases")
+unreadable = []
+
+
+def flush(paths, records):
+    """Embed and index one batch, skipping images that cannot be decoded; returns how many were added"""
+    arrays, kept = [], []
+    for path, record in zip(paths, records):
+        try:
+            arrays.append(predict.preprocess_image(path))
+            kept.append(record)
+        except Exception as e:
+            print(f"  ⚠️ cannot read {path}: {e}")
+            unreadable.append(path)
+    if arrays:
+        index.add(predict.embed_images(np.concatenate(arrays)), kept)
+    return len(kept)
+
+
+start = time.perf_counter()
+added = 0
+for class_name in sorted(os.listdir(SOURCE_DIR)):
+    class_dir = os.path.join(SOURCE_DIR, class_name)
+    if not os.path.isdir(class_dir):
+        continue
+
+    paths, records = [], []
+    for img_name in sorted(os.listdir(class_dir)):
+        if not img_name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            continue
+        path = os.path.join(class_dir, img_name)
+        if path in index.ids:
+            continue
+        paths.append(path)
+        records.append({'id': path, 'source': 'train', 'label': class_name, 'filename': img_name})
+        if len(paths) == BATCH_SIZE:
+            added += flush(paths, records)
+            paths, records = [], []
+    added += flush(paths, records)
+    print(f"[{class_name}] indexed")
+
+print(f"✅ Added {added} images in {time.perf_counter() - start:.1f} s "
+      f"({len(unreadable)} unreadable skipped), training IVF lists...")
+index.train()
+print(f"✅ Index holds {len(index)} cases in {len(index.centroids)} lists")
@@ -0,0 +1,250 @@
+import argparse
+import hashlib
+import io
+import os
+import random
+import signal
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import nullcontext
+from zipfile import ZipFile, BadZipFile
+from PIL import Image
+
+# Dataset tools. Run from the project root, e.g.
+#   python helper/dataset_tools.py sample --per-class 10 --seed 0 -o palm_sample.zip
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+PROGRESS_EVERY = 500  # images between throughput reports
+
+# (archive name, entry key) pairs the previous archive can supply, set once per worker process
+reusable_entries = frozenset()
+
+
+def init_worker(reusable):
+    global reusable_entries
+    reusable_entries = reusable
+    # The parent decides when to stop and shuts the pool down cleanly
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+
+def find_strata(source_dir):
+    """Map every folder holding images (e.g. 'diseases/train/healthy') to its sorted image names"""
+    strata = {}
+    for root, _, files in os.walk(source_dir):
+        images = sorted(f for f in files if f.lower().endswith(IMAGE_EXTENSIONS))
+        if images:
+            strata[os.path.relpath(root, source_dir)] = images
+    return dict(sorted(strata.items()))
+
+
+def sample_strata(strata, per_class, fraction, seed):
+    """Pick the same images for the same seed, independently per stratum"""
+    picked = {}
+    for stratum, images in strata.items():
+        if per_class is not None:
+            n_pick = min(per_class, len(images))
+            if len(images) < per_class:
+                print(f"  ⚠️ [{stratum}] only {len(images)} available, sampling all")
+        else:
+            n_pick = max(1, round(len(images) * fraction))
+        picked[stratum] = sorted(random.Random(f"{seed}:{stratum}").sample(images, n_pick))
+    return picked
+
+
+def archive_names(stratum, images):
+    """JPEG names inside the zip; 'x.jpg' and 'x.png' in one folder keep distinct names
+
+    Pass every image in the folder, not just a sample, so a source file gets
+    the same name in every run whatever else was sampled.
+    """
+    stems = Counter(os.path.splitext(name)[0] for name in images)
+    names = {}
+    for name in images:
+        stem, ext = os.path.splitext(name)
+        suffix = '' if stems[stem] == 1 else '_' + ext[1:]
+        names[name] = f"{stratum}/{stem}{suffix}.jpg".replace(os.sep, '/')
+    return names
+
+
+def entry_key(digest, quality):
+    """Stored in each entry's comment: an entry is reusable only for the same source bytes and quality"""
+    return f"{digest} q{quality}"
+
+
+def encode(task):
+    """Re-encode one image to JPEG
+
+    Returns (arcname, entry key, jpeg bytes, source size, error). jpeg is None
+    when the previous archive already holds this exact entry, or when the
+    image cannot be read (error says why).
+    """
+    path, arcname, quality = task
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+        key = entry_key(hashlib.sha256(data).hexdigest(), quality)
+        if (arcname, key) in reusable_entries:
+            return arcname, key, None, len(data), None
+        with Image.open(io.BytesIO(data)) as img:
+            out = io.BytesIO()
+            img.convert('RGB').save(out, 'JPEG', quality=quality)
+        return arcname, key, out.getvalue(), len(data), None
+    except Exception as e:
+        return arcname, None, None, 0, str(e)
+
+
+def read_entries(zip_path):
+    """{archive name: entry key} recorded by a previous (partial) run, or None if unreadable"""
+    try:
+        with ZipFile(zip_path) as zf:
+            return {info.filename: info.comment.decode() for info in zf.infolist() if info.comment}
+    except (BadZipFile, OSError) as e:
+        print(f"⚠️  Cannot resume from '{zip_path}' ({e})")
+        return None
+
+
+def write_entry(zf, arcname, data, key):
+    zf.writestr(arcname, data)
+    # The entry key rides along in the comment so reruns can reuse the entry
+    zf.getinfo(arcname).comment = key.encode()
+
+
+def find_previous(paths):
+    """First archive among paths a resumed run can reuse entries from: (path, entries)"""
+    for path in paths:
+        if os.path.exists(path):
+            entries = read_entries(path)
+            if entries is not None:
+                return path, entries
+    return None, {}
+
+
+def stop_on_sigterm(signum, frame):
+    # Stop like Ctrl-C once; repeated TERMs (e.g. sent to the whole process group) are ignored
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+
+def sample(args):
+    strata = find_strata(args.source)
+    if not strata:
+        print(f"❌ No images found under '{args.source}'—check the path and extensions.")
+        return 1
+    picked = sample_strata(strata, args.per_class, args.fraction, args.seed)
+
+    tasks = []
+    for stratum, images in picked.items():
+        print(f"[{stratum}] {len(images)}/{len(strata[stratum])} images")
+        names = archive_names(stratum, strata[stratum])
+        for name in images:
+            tasks.append((os.path.join(args.source, stratum, name), names[name], args.quality))
+
+    # Write to a .part file so a finished archive is never mistaken for a partial one.
+    # A resumed run rebuilds the archive, copying over the entries that still
+    # match a task (same name, source bytes and quality) from the previous one.
+    part_path = args.output + '.part'
+    prev_path = args.output + '.prev'  # Only left behind when a resumed run is killed outright
+    previous, entries = None, {}
+    if args.resume:
+        previous, entries = find_previous([prev_path, part_path, args.output])
+    for path in (prev_path, part_path):
+        if path != previous and os.path.exists(path):
+            os.remove(path)
+    if previous is not None:
+        os.replace(previous, prev_path)
+        task_names = {arcname for _, arcname, _ in tasks}
+        entries = {arcname: key for arcname, key in entries.items() if arcname in task_names}
+        print(f"↻ Resuming: {len(entries)} images in '{previous}' may be reused")
+    reusable = frozenset(entries.items())
+    paths = {arcname: path for path, arcname, _ in tasks}
+
+    signal.signal(signal.SIGTERM, stop_on_sigterm)
+    start = time.perf_counter()
+    packed = reused = source_bytes = 0
+    unreadable = []
+    written = set()
+    interrupted = False
+    with ZipFile(part_path, 'w') as zf, \
+            ZipFile(prev_path) if previous is not None else nullcontext() as prev_zf, \
+            ProcessPoolExecutor(args.workers, initializer=init_worker, initargs=(reusable,)) as pool:
+        pending = set()
+        queue = iter(tasks)
+        try:
+            while True:
+                # Keep a bounded number of encoded images in flight
+                for task in queue:
+                    pending.add(pool.submit(encode, task))
+                    if len(pending) >= args.workers * 4:
+                        break
+                if not pending:
+                    break
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    arcname, key, jpeg, size, error = future.result()
+                    if error is not None:
+                        print(f"  ⚠️ cannot read {paths[arcname]}: {error}")
+                        unreadable.append(paths[arcname])
+                        continue
+                    if arcname in written:
+                        continue
+                    if jpeg is None:
+                        write_entry(zf, arcname, prev_zf.read(arcname), key)
+                        reused += 1
+                    else:
+                        write_entry(zf, arcname, jpeg, key)
+                        packed += 1
+                        source_bytes += size
+                        if packed % PROGRESS_EVERY == 0:
+                            elapsed = time.perf_counter() - start
+                            print(f"  … {len(written) + 1}/{len(tasks)} images, {packed / elapsed:.1f} img/s")
+                    written.add(arcname)
+        except KeyboardInterrupt:
+            interrupted = True
+            pool.shutdown(wait=False, cancel_futures=True)
+            print("⏸  Interrupted, closing archive; rerun with --resume to continue")
+            # Carry over what was not checked yet; the next run verifies it by its key
+            for arcname in entries.keys() - written:
+                write_entry(zf, arcname, prev_zf.read(arcname), entries[arcname])
+
+    if previous is not None:
+        os.remove(prev_path)
+    elapsed = time.perf_counter() - start
+    if not interrupted:
+        os.replace(part_path, args.output)
+    output_path = part_path if interrupted else args.output
+    print(f"{'⏸' if interrupted else '✅'} Packed {packed} images ({reused} reused, "
+          f"{len(unreadable)} unreadable) into '{output_path}' in {elapsed:.1f} s: "
+          f"{packed / elapsed if elapsed else 0:.1f} img/s, "
+          f"{source_bytes / 2**20 / elapsed if elapsed else 0:.1f} MB/s read, "
+          f"{os.path.getsize(output_path) / 2**20:.1f} MB archive")
+    return 130 if interrupted else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Palm dataset tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    sample_cmd = commands.add_parser('sample', help="stratified sample of every image folder, re-encoded into a zip")
+    sample_cmd.add_argument('--source', default='dataset', help="dataset root (default: dataset)")
+    size = sample_cmd.add_mutually_exclusive_group()
+    size.add_argument('--per-class', type=int, default=None, help="images per folder (default: 10)")
+    size.add_argument('--fraction', type=float, help="fraction of each folder to keep, e.g. 0.1")
+    sample_cmd.add_argument('--seed', type=int, default=0, help="sampling seed (default: 0)")
+    sample_cmd.add_argument('-o', '--output', default='palm_sample.zip', help="zip to write")
+    sample_cmd.add_argument('--quality', type=int, default=90, help="JPEG quality (default: 90)")
+    sample_cmd.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="encoder processes")
+    sample_cmd.add_argument('--resume', action='store_true',
+                            help="reuse images already in the output (matched by source hash and quality)")
+    sample_cmd.set_defaults(handler=sample)
+
+    args = parser.parse_args(argv)
+    if args.command == 'sample' and args.per_class is None and args.fraction is None:
+        args.per_class = 10
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,189 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dedup import HashIndex, DisjointSet, phash, dhash, hamming, HASH_DUPLICATE_DISTANCE
+from similarity import EmbeddingIndex, EMBEDDING_DUPLICATE_SIMILARITY
+
+# === CONFIG ===
+# Finds near-duplicate images within each collection (perceptual hash and CNN
+# embedding matches), writes a JSON report and a manifest that keeps one image
+# per duplicate cluster. A hash match needs pHash and dHash to agree.
+# Run from the project root: python helper/dedup_dataset.py [--hash-only]
+COLLECTIONS = {                          # duplicates are only searched within a collection
+    'diseases': ['dataset/diseases', 'test'],
+    'binary': ['dataset/binary'],
+}
+SPLIT_PRIORITY = {'train': 2, 'val': 1}  # on equal resolution, keep the training copy
+NEIGHBOURS = 10                          # embedding neighbours checked per image
+BATCH_SIZE = 64
+WORKERS = os.cpu_count() or 4            # PIL decoding releases the GIL, so threads scale
+REPORT_PATH = 'dedup_report.json'
+MANIFEST_PATH = 'dedup_manifest.txt'
+
+predict = None  # Imported by main() unless --hash-only
+
+
+def list_images(roots):
+    paths = []
+    for root in roots:
+        for dirpath, _, files in os.walk(root):
+            paths.extend(os.path.join(dirpath, f) for f in files
+                         if f.lower().endswith(('.jpg', '.jpeg', '.png')))
+    return sorted(paths)
+
+
+def split_of(path, roots):
+    for root in roots:
+        if path.startswith(root + os.sep):
+            rel = os.path.relpath(path, root).split(os.sep)
+            return rel[0] if len(rel) > 2 else os.path.basename(root)
+    return None
+
+
+def load(path, embed):
+    """Hash and (optionally) preprocess one image; None when it cannot be decoded"""
+    try:
+        with Image.open(path) as image:
+            width, height = image.size  # Before draft(), which shrinks a JPEG's reported size
+            if not embed:
+                # The hashes work on a 32x32 thumbnail; embeddings need the same full decode as serving
+                image.draft('RGB', (224, 224))
+            image.load()
+            return {
+                'phash': phash(image),
+                'dhash': dhash(image),
+                'pixels': width * height,
+                'array': predict.preprocess_image(image) if embed else None,
+            }
+    except Exception as e:
+        print(f"  ⚠️ cannot read {path}: {e}")
+        return None
+
+
+def load_batches(pool, paths, embed):
+    """Yield (paths, results) per batch, decoding the next batch while the caller embeds this one"""
+    batches = [paths[i:i + BATCH_SIZE] for i in range(0, len(paths), BATCH_SIZE)]
+    pending = [pool.submit(load, path, embed) for path in batches[0]] if batches else []
+    for i, batch in enumerate(batches):
+        current = pending
+        pending = [pool.submit(load, path, embed) for path in batches[i + 1]] if i + 1 < len(batches) else []
+        yield batch, [future.result() for future in current]
+
+
+def find_clusters(name, roots, pool, index_dir, embed):
+    paths = list_images(roots)
+    print(f"[{name}] {len(paths)} images")
+
+    hashes = HashIndex()
+    dhashes = {}
+    embeddings = EmbeddingIndex(index_dir, predict.EMBEDDING_DIM) if embed else None
+    clusters = DisjointSet()
+    matches = {}  # frozenset({a, b}) -> (a, b, kind, score), one entry per pair
+    info = {}
+    unreadable = []
+
+    def match(a, b, kind, score):
+        clusters.union(a, b)
+        matches.setdefault(frozenset((a, b)), (a, b, kind, score))
+
+    # === HASH PASS (and embedding extraction) ===
+    for batch, results in load_batches(pool, paths, embed):
+        readable = [(path, result) for path, result in zip(batch, results) if result is not None]
+        unreadable.extend(path for path, result in zip(batch, results) if result is None)
+        for path, result in readable:
+            for distance, other in hashes.query(result['phash']):
+                # pHash alone can collide on flat, low-detail images; the gradient hash must agree too
+                if hamming(result['dhash'], dhashes[other]) <= HASH_DUPLICATE_DISTANCE:
+                    match(path, other, 'phash', distance)
+            hashes.add(path, result['phash'])
+            dhashes[path] = result['dhash']
+            info[path] = {'split': split_of(path, roots), 'pixels': result['pixels'],
+                          'phash': f"{result['phash']:016x}", 'dhash': f"{result['dhash']:016x}"}
+        if embeddings is not None and readable:
+            batch_arrays = np.concatenate([result['array'] for _, result in readable])
+            embeddings.add(predict.embed_images(batch_arrays), [{'id': path} for path, _ in readable])
+
+    # === EMBEDDING PASS ===
+    if embeddings is not None and len(embeddings):
+        embeddings.train()
+        for path in info:
+            for score, record in embeddings.search(embeddings.vector(path), k=NEIGHBOURS, exclude={path}):
+                if score < EMBEDDING_DUPLICATE_SIMILARITY:
+                    break
+                # The search is approximate, so a pair may only turn up from one end
+                match(path, record['id'], 'embedding', round(score, 4))
+
+    return info, clusters, list(matches.values()), unreadable
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Find near-duplicate images in the dataset")
+    parser.add_argument('--hash-only', action='store_true',
+                        help="skip CNN embedding matches (no tensorflow needed)")
+    args = parser.parse_args()
+    embed = not args.hash_only
+    if embed:
+        import predict
+
+    start = time.perf_counter()
+    report = {'collections': {}, 'unreadable': []}
+    keep = []
+
+    with ThreadPoolExecutor(WORKERS) as pool, tempfile.TemporaryDirectory() as tmp:
+        for name, roots in COLLECTIONS.items():
+            info, clusters, matches, unreadable = find_clusters(name, roots, pool, os.path.join(tmp, name), embed)
+            report['unreadable'].extend(unreadable)
+
+            groups = clusters.clusters()
+            cluster_of = {path: i for i, members in enumerate(groups) for path in members}
+            cluster_matches = [[] for _ in groups]
+            for a, b, kind, score in matches:
+                cluster_matches[cluster_of[a]].append({'a': a, 'b': b, 'kind': kind, 'score': score})
+
+            entries = []
+            dropped = set()
+            for members, pair_matches in zip(groups, cluster_matches):
+                # Keep the highest-resolution copy of each cluster
+                kept = max(members, key=lambda path: (info[path]['pixels'],
+                                                      SPLIT_PRIORITY.get(info[path]['split'], 0), path))
+                dropped.update(path for path in members if path != kept)
+                splits = sorted({info[path]['split'] for path in members})
+                entries.append({
+                    'keep': kept,
+                    'members': [{'path': path, **info[path]} for path in members],
+                    'splits': splits,
+                    'cross_split': len(splits) > 1,
+                    'matches': pair_matches,
+                })
+            keep.extend(path for path in info if path not in dropped)
+
+            report['collections'][name] = {
+                'images': len(info),
+                'clusters': len(entries),
+                'duplicates_dropped': len(dropped),
+                'cross_split_clusters': sum(entry['cross_split'] for entry in entries),
+                'duplicate_clusters': sorted(entries, key=lambda entry: -len(entry['members'])),
+            }
+            print(f"[{name}] {len(entries)} duplicate clusters, "
+                  f"{report['collections'][name]['cross_split_clusters']} spanning splits, "
+                  f"{len(dropped)} images dropped")
+
+    report['settings'] = {
+        'hash_max_distance': HASH_DUPLICATE_DISTANCE,  # for both pHash and dHash
+        'embedding_min_similarity': EMBEDDING_DUPLICATE_SIMILARITY if embed else None,
+    }
+    with open(REPORT_PATH, 'w') as file:
+        json.dump(report, file, indent=2)
+    with open(MANIFEST_PATH, 'w') as file:
+        file.write('\n'.join(sorted(keep)) + '\n')
+
+    print(f"✅ Kept {len(keep)} images in '{MANIFEST_PATH}', report in '{REPORT_PATH}' "
+          f"({time.perf_counter() - start:.1f} s)")
@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import predict
+
+# === CONFIG ===
+VAL_DIR = 'dataset/diseases/val'   # one subfolder per class, named like predict.labels
+
+label_indices = {name: index for index, name in predict.labels.items()}
+
+total = 0
+correct = {'base': 0, 'tta': 0}
+triggered = 0
+latency = {'base': 0.0, 'tta': 0.0}
+
+# Warm up so graph tracing is not charged to the first image
+warmup = np.zeros((1, *predict.IMAGE_SIZE, 3), dtype=np.float32)
+predict.model.predict_on_batch(warmup)
+predict.model.predict_on_batch(predict.augment_views(warmup))
+
+# === EVALUATE ===
+for class_name in sorted(os.listdir(VAL_DIR)):
+    class_dir = os.path.join(VAL_DIR, class_name)
+    if not os.path.isdir(class_dir) or class_name not in label_indices:
+        print(f"⚠️  {class_dir} is not a model class, skipping")
+        continue
+
+    for img_name in sorted(os.listdir(class_dir)):
+        if not img_name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            continue
+        image_data = predict.preprocess_image(os.path.join(class_dir, img_name))
+
+        for mode, tta in (('base', False), ('tta', True)):
+            start = time.perf_counter()
+            probabilities = predict.predict_probabilities(image_data, tta=tta)
+            latency[mode] += time.perf_counter() - start
+            correct[mode] += int(probabilities.argmax() == label_indices[class_name])
+            if mode == 'base':
+                low, high = predict.TTA_BAND
+                triggered += int(low <= probabilities.max() < high)
+        total += 1
+
+# === REPORT ===
+if total == 0:
+    print(f"❌ No images found under {VAL_DIR}")
+else:
+    base_acc, tta_acc = correct['base'] / total, correct['tta'] / total
+    added_ms = (latency['tta'] - latency['base']) / total * 1000
+    print(f"images: {total}  TTA views: {predict.tta_transforms().shape[0]}  band: {predict.TTA_BAND}")
+    print(f"accuracy  base: {base_acc:.4f}  tta: {tta_acc:.4f}  gain: {tta_acc - base_acc:+.4f}")
+    print(f"TTA triggered on {triggered}/{total} images ({triggered / total:.1%})")
+    print(f"latency   base: {latency['base'] / total * 1000:.1f} ms  "
+          f"added by TTA: {added_ms:.1f} ms/image avg"
+          + (f", {added_ms * total / triggered:.1f} ms per triggered image" if triggered else ""))
@@ -1,10 +1,42 @@
+import os
 import numpy as np
-from tensorflow.keras.models import load_model
+from functools import lru_cache
+from itertools import product
 from PIL import Image, ImageOps
 from os import listdir
+from worker_cpus import available_cpus
+
+# TensorFlow thread pools. Each gunicorn worker runs its own runtime, so by default
+# a worker gets its pinned CPU group (WORKER_CPUS, set by gunicorn.conf.py) or an
+# equal share of this machine instead of every core. 0 means pick automatically.
+WORKER_COUNT = int(os.environ.get("GUNICORN_WORKERS", os.environ.get("WEB_CONCURRENCY", "1")))
+WORKER_CPU_SHARE = int(os.environ.get("WORKER_CPUS", "0")) or max(1, len(available_cpus()) // WORKER_COUNT)
+TF_INTRA_OP_THREADS = int(os.environ.get("TF_INTRA_OP_THREADS", "0")) or WORKER_CPU_SHARE
+# Single-image MobileNetV2 inference is one chain of ops, so a wide inter-op pool only adds contention
+TF_INTER_OP_THREADS = int(os.environ.get("TF_INTER_OP_THREADS", "0")) or (2 if TF_INTRA_OP_THREADS >= 8 else 1)
+
+# oneDNN's OpenMP pool is sized when tensorflow is imported
+os.environ.setdefault("OMP_NUM_THREADS", str(TF_INTRA_OP_THREADS))
+
+import tensorflow as tf
+from tensorflow.keras.models import load_model
+
+tf.config.threading.set_intra_op_parallelism_threads(TF_INTRA_OP_THREADS)
+tf.config.threading.set_inter_op_parallelism_threads(TF_INTER_OP_THREADS)
 
 model = load_model([i for i in listdir(".") if i.endswith(".keras")][0]) # funny line hehe
 
+# MobileNetV2's pooled features double as an image embedding for similar-case search,
+# taken from the same forward pass that produces the class probabilities
+embedding_layer = next(
+    (layer for layer in model.layers if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D)), None)
+if embedding_layer is not None:
+    scoring_model = tf.keras.Model(model.inputs, [model.output, embedding_layer.output])
+    EMBEDDING_DIM = int(embedding_layer.output.shape[-1])
+else:
+    scoring_model = None
+    EMBEDDING_DIM = None
+
 labels = {
     0:"black_scorch", 
     1:"fusarium_wilt", 
@@ -18,30 +50,105 @@ labels = {
     9:"unknown"
 }
 
+IMAGE_SIZE = (224, 224)
+
+# Test-time augmentation: uncertain predictions are re-scored over augmented views
+TTA_ENABLED = os.environ.get("TTA_ENABLED", "0") == "1"
+TTA_BAND = (
+    float(os.environ.get("TTA_BAND_LOW", "0.35")),  # first-pass confidence range
+    float(os.environ.get("TTA_BAND_HIGH", "0.75")),  # that triggers the TTA pass
+)
+TTA_FLIPS = (False, True)  # horizontal mirror
+TTA_ANGLES = (-10.0, 0.0, 10.0)  # rotation in degrees
+TTA_SCALES = (1.0, 1.15)  # zoom factor; above 1 is a centre crop
+
 def preprocess_image(image):
-    image = Image.open(image).convert("RGB")
-    image = ImageOps.fit(image, (224, 224), Image.Resampling.LANCZOS)
-    image_array = np.asarray(image).astype(np.float32) / 255.0  # Normalize
-    image_array = np.expand_dims(image_array, axis=0)  # Shape: (1, 224, 224, 3)
-    return image_array
+    """Decode an image (path, file object or already opened PIL image) into a model batch"""
+    if not isinstance(image, Image.Image):
+        image = Image.open(image)
+    image = ImageOps.fit(image.convert("RGB"), IMAGE_SIZE, Image.Resampling.LANCZOS)
+    image_array = np.asarray(image, dtype=np.float32)
+    image_array /= 255.0  # Normalize in place
+    return image_array[np.newaxis]  # Shape: (1, 224, 224, 3)
+
+@lru_cache(maxsize=None)
+def tta_transforms(size=IMAGE_SIZE, flips=TTA_FLIPS, angles=TTA_ANGLES, scales=TTA_SCALES):
+    """Projective transforms for every augmented view except the identity"""
+    width, height = size
+    cx, cy = (width - 1) / 2, (height - 1) / 2
+    transforms = []
+    for flip, angle, scale in product(flips, angles, scales):
+        if not flip and angle == 0 and scale == 1:
+            continue  # The first pass already scored the original image
+        # Maps each output pixel to its source pixel, rotating and zooming about the centre
+        theta = np.deg2rad(angle)
+        mirror = -1.0 if flip else 1.0
+        a0, a1 = mirror * np.cos(theta) / scale, -np.sin(theta) / scale
+        b0, b1 = mirror * np.sin(theta) / scale, np.cos(theta) / scale
+        transforms.append([a0, a1, cx - a0 * cx - a1 * cy, b0, b1, cy - b0 * cx - b1 * cy, 0.0, 0.0])
+    return tf.constant(transforms, dtype=tf.float32)
+
+def augment_views(image_data):
+    """Build all TTA views of a (1, H, W, 3) batch in a single vectorized op"""
+    transforms = tta_transforms()
+    images = tf.repeat(tf.convert_to_tensor(image_data), transforms.shape[0], axis=0)
+    return tf.raw_ops.ImageProjectiveTransformV3(
+        images=images,
+        transforms=transforms,
+        output_shape=tf.constant(image_data.shape[1:3], dtype=tf.int32),
+        fill_value=0.0,
+        interpolation="BILINEAR",
+        fill_mode="REFLECT",
+    )
+
+def score_image(image_data, tta=None):
+    """Class probabilities and embedding (None without a pooling layer) for a single image
+
+    The probabilities are re-scored with TTA when uncertain; the embedding
+    always comes from the unaugmented first pass.
+    """
+    if scoring_model is not None:
+        probabilities, embeddings = scoring_model.predict_on_batch(image_data)
+        probabilities, embedding = probabilities[0], embeddings[0]
+    else:
+        probabilities, embedding = model.predict_on_batch(image_data)[0], None
+    if tta is None:
+        tta = TTA_ENABLED
+    if tta and TTA_BAND[0] <= probabilities.max() < TTA_BAND[1]:
+        # One forward pass over every augmented view, averaged with the first pass
+        view_probabilities = model.predict_on_batch(augment_views(image_data))
+        probabilities = (probabilities + view_probabilities.sum(axis=0)) / (len(view_probabilities) + 1)
+    return probabilities, embedding
+
+def predict_probabilities(image_data, tta=None):
+    """Class probabilities for a single image, re-scored with TTA when uncertain"""
+    return score_image(image_data, tta)[0]
+
+def embed_images(image_batch):
+    """Embeddings for a (N, 224, 224, 3) batch in one forward pass"""
+    if scoring_model is None:
+        raise RuntimeError("Model has no GlobalAveragePooling2D layer to take embeddings from")
+    return scoring_model.predict_on_batch(image_batch)[1]
 
-def predict(image_data):
-    predictions = model.predict(image_data)
-    predicted_class_index = np.argmax(predictions)
+def predict(image_data, probabilities=None):
+    if probabilities is None:
+        probabilities = predict_probabilities(image_data)
+    predicted_class_index = int(np.argmax(probabilities))
 
-    confidence = predictions[0][predicted_class_index]
+    confidence = probabilities[predicted_class_index]
     labeled_prediction = labels[predicted_class_index]
     
     print(f"prediction: {labeled_prediction}  confidence: {confidence:.2f}")
     return confidence, labeled_prediction
 
-def get_all_predictions(image_data):
+def get_all_predictions(image_data, probabilities=None):
     """Get all predictions sorted by confidence"""
-    predictions = model.predict(image_data)
+    if probabilities is None:
+        probabilities = predict_probabilities(image_data)
     
     # Create list of all predictions with their labels and confidence scores
     all_predictions = []
-    for class_index, confidence in enumerate(predictions[0]):
+    for class_index, confidence in enumerate(probabilities):
         disease_name = labels[class_index]
         all_predictions.append({
             'disease': disease_name,
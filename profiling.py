@@ -0,0 +1,323 @@
+import hmac
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import nullcontext
+from functools import wraps
+from flask import request, jsonify
+
+# Opt-in request profiling. A sampled request records per-stage spans and a
+# statistical stack profile (collapsed-stack format, ready for flamegraph.pl or
+# speedscope). Requests are sampled at PROFILE_SAMPLE_RATE, or at the rate of a
+# time window opened through POST /admin/profile, which can also capture a
+# TensorFlow op-level trace for TensorBoard. Output is appended per worker
+# under PROFILE_DIR so the admin endpoints can merge every gunicorn worker.
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_ADMIN_TOKEN = os.environ.get('PROFILE_ADMIN_TOKEN')  # Admin endpoints are off without it
+SAMPLE_INTERVAL = float(os.environ.get('PROFILE_SAMPLE_INTERVAL', '0.005'))  # seconds
+CONTROL_POLL_INTERVAL = 1.0  # How often workers look for a window opened by another worker
+MAX_WINDOW_SECONDS = 3600
+RECENT_REQUESTS = 20
+
+CONTROL_PATH = os.path.join(PROFILE_DIR, 'control.json')
+TF_TRACE_DIR = os.path.join(PROFILE_DIR, 'tf')
+
+_local = threading.local()
+_NULL_SPAN = nullcontext()
+_control = {'until': 0.0, 'rate': 0.0, 'tf_trace': False, 'mtime': None, 'next_poll': 0.0}
+_tf_tracing = False
+
+
+class RequestProfile:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.thread_id = threading.get_ident()
+        self.start = time.perf_counter()
+        self.active_spans = []
+        self.spans = []
+        self.samples = Counter()
+
+
+class Span:
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.profile.active_spans.append(self.name)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration_ms = (time.perf_counter() - self.start) * 1000
+        self.profile.active_spans.pop()
+        self.profile.spans.append({'name': self.name, 'ms': round(duration_ms, 3)})
+        return False
+
+
+def span(name):
+    """Time a stage of the current request; a shared no-op unless the request is profiled"""
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return _NULL_SPAN
+    return Span(profile, name)
+
+
+def collapse(frame, profile):
+    """One collapsed-stack line, rooted at the endpoint and the innermost open span"""
+    frames = []
+    while frame is not None:
+        frames.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    # Slicing avoids racing the request thread closing its last span
+    root = [profile.endpoint] + [f"span:{name}" for name in profile.active_spans[-1:]]
+    return ';'.join(root + frames[::-1])
+
+
+class Sampler:
+    """Background thread that samples the stacks of profiled request threads"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.profiles = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, profile):
+        with self.lock:
+            self.profiles[profile.thread_id] = profile
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='profile-sampler', daemon=True)
+                self.thread.start()
+
+    def remove(self, profile):
+        """Stop sampling a profile and return a snapshot of its samples"""
+        with self.lock:
+            self.profiles.pop(profile.thread_id, None)
+            return dict(profile.samples)
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.profiles:
+                    self.thread = None
+                    return
+                profiles = list(self.profiles.values())
+            frames = sys._current_frames()
+            stacks = [(profile, collapse(frames[profile.thread_id], profile))
+                      for profile in profiles if profile.thread_id in frames]
+            del frames
+            # Counted under the lock, and only while still registered, so finish_request's snapshot is final
+            with self.lock:
+                for profile, stack in stacks:
+                    if self.profiles.get(profile.thread_id) is profile:
+                        profile.samples[stack] += 1
+            time.sleep(self.interval)
+
+
+sampler = Sampler(SAMPLE_INTERVAL)
+
+
+def _poll_control():
+    """Pick up a profiling window opened (or closed) through any worker"""
+    _control['next_poll'] = time.monotonic() + CONTROL_POLL_INTERVAL
+    try:
+        mtime = os.path.getmtime(CONTROL_PATH)
+    except OSError:
+        mtime = None
+    if mtime != _control['mtime']:
+        _control['mtime'] = mtime
+        state = {'until': 0.0, 'rate': 0.0, 'tf_trace': False}
+        if mtime is not None:
+            try:
+                with open(CONTROL_PATH) as file:
+                    state.update(json.load(file))
+            except (OSError, ValueError) as e:
+                logging.warning(f"Ignoring unreadable profiling control file: {e}")
+        _control.update(state)
+    _sync_tf_trace()
+
+
+def _sync_tf_trace():
+    global _tf_tracing
+    wanted = _control['tf_trace'] and time.time() < _control['until']
+    if wanted == _tf_tracing:
+        return
+    try:
+        import tensorflow as tf
+        if wanted:
+            tf.profiler.experimental.start(os.path.join(TF_TRACE_DIR, str(os.getpid())))
+        else:
+            tf.profiler.experimental.stop()
+        _tf_tracing = wanted
+    except Exception as e:
+        logging.warning(f"TensorFlow trace could not be {'started' if wanted else 'stopped'}: {e}")
+        _control['tf_trace'] = False
+        _tf_tracing = False
+
+
+def should_profile():
+    if time.monotonic() >= _control['next_poll']:
+        _poll_control()
+    rate = _control['rate'] if time.time() < _control['until'] else PROFILE_SAMPLE_RATE
+    return rate > 0 and random.random() < rate
+
+
+def start_request(endpoint):
+    profile = RequestProfile(endpoint)
+    _local.profile = profile
+    sampler.add(profile)
+
+
+def finish_request():
+    profile = getattr(_local, 'profile', None)
+    if profile is None:
+        return
+    _local.profile = None
+    samples = sampler.remove(profile)
+
+    pid = os.getpid()
+    record = {
+        'pid': pid,
+        'endpoint': profile.endpoint,
+        'total_ms': round((time.perf_counter() - profile.start) * 1000, 3),
+        'spans': profile.spans,
+        'samples': sum(samples.values()),
+        'timestamp': time.time(),
+    }
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(os.path.join(PROFILE_DIR, f'spans-{pid}.jsonl'), 'a') as file:
+            file.write(json.dumps(record) + '\n')
+        with open(os.path.join(PROFILE_DIR, f'collapsed-{pid}.txt'), 'a') as file:
+            file.writelines(f"{stack} {count}\n" for stack, count in samples.items())
+    except OSError as e:
+        logging.error(f"Failed to write request profile: {e}")
+
+
+def _output_files(prefix):
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    return [os.path.join(PROFILE_DIR, name) for name in sorted(os.listdir(PROFILE_DIR)) if name.startswith(prefix)]
+
+
+def collapsed_stacks():
+    """Merge every worker's samples into one collapsed-stack profile"""
+    totals = Counter()
+    for path in _output_files('collapsed-'):
+        with open(path) as file:
+            for line in file:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack:
+                    totals[stack] += int(count)
+    return totals
+
+
+def span_summary():
+    durations = defaultdict(list)
+    requests = []
+    for path in _output_files('spans-'):
+        with open(path) as file:
+            for line in file:
+                record = json.loads(line)
+                requests.append(record)
+                durations['(request)'].append(record['total_ms'])
+                for recorded in record['spans']:
+                    durations[recorded['name']].append(recorded['ms'])
+
+    def stats(values):
+        values = sorted(values)
+        return {
+            'count': len(values),
+            'mean_ms': round(sum(values) / len(values), 3),
+            'p50_ms': values[len(values) // 2],
+            'p95_ms': values[min(len(values) - 1, int(len(values) * 0.95))],
+            'max_ms': values[-1],
+        }
+
+    requests.sort(key=lambda record: record['timestamp'])
+    return {name: stats(values) for name, values in durations.items()}, requests
+
+
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not PROFILE_ADMIN_TOKEN:
+            return jsonify({'error': 'Not found'}), 404
+        token = request.headers.get('X-Admin-Token', '')
+        if not hmac.compare_digest(token.encode(), PROFILE_ADMIN_TOKEN.encode()):
+            return jsonify({'error': 'Forbidden'}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def init_app(app, skip_endpoints=('static',)):
+    """Sample requests through Flask hooks and register the /admin/profile endpoints"""
+
+    @app.before_request
+    def begin_profile():
+        if request.endpoint not in skip_endpoints and not request.path.startswith('/admin/') and should_profile():
+            start_request(request.endpoint or request.path)
+
+    @app.teardown_request
+    def end_profile(exc):
+        finish_request()
+
+    @admin_required
+    def profile_status():
+        spans, requests = span_summary()
+        stacks = collapsed_stacks()
+        return jsonify({
+            'window_open': time.time() < _control['until'],
+            'window_until': _control['until'],
+            'window_sample_rate': _control['rate'],
+            'default_sample_rate': PROFILE_SAMPLE_RATE,
+            'tf_trace': _control['tf_trace'],
+            'tf_trace_dir': TF_TRACE_DIR,
+            'profiled_requests': len(requests),
+            'stack_samples': sum(stacks.values()),
+            'spans': spans,
+            'recent_requests': requests[-RECENT_REQUESTS:],
+        })
+
+    @admin_required
+    def open_window():
+        data = request.get_json(silent=True) or {}
+        try:
+            duration = min(max(float(data.get('duration_s', 60)), 0), MAX_WINDOW_SECONDS)
+            rate = min(max(float(data.get('sample_rate', 1.0)), 0), 1)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'duration_s and sample_rate must be numbers'}), 400
+        state = {'until': time.time() + duration, 'rate': rate, 'tf_trace': bool(data.get('tf_trace', False))}
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        tmp_path = CONTROL_PATH + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(state, file)
+        os.replace(tmp_path, CONTROL_PATH)
+        _poll_control()
+        return jsonify({'success': True, **state})
+
+    @admin_required
+    def reset_profiles():
+        for path in _output_files('spans-') + _output_files('collapsed-') + _output_files('control.json'):
+            os.remove(path)
+        _poll_control()
+        return jsonify({'success': True, 'message': 'Profiling window closed and samples cleared'})
+
+    @admin_required
+    def flamegraph():
+        stacks = collapsed_stacks()
+        body = ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        return app.response_class(body, mimetype='text/plain')
+
+    app.add_url_rule('/admin/profile', 'profile_status', profile_status, methods=['GET'])
+    app.add_url_rule('/admin/profile', 'open_profile_window', open_window, methods=['POST'])
+    app.add_url_rule('/admin/profile', 'reset_profiles', reset_profiles, methods=['DELETE'])
+    app.add_url_rule('/admin/profile/flamegraph', 'profile_flamegraph', flamegraph, methods=['GET'])
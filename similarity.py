@@ -0,0 +1,350 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import numpy as np
+
+# Where the app and helper/build_index.py keep the index
+INDEX_DIR = os.environ.get('SIMILARITY_INDEX_DIR', 'similarity_index')
+
+# IVF (inverted file) parameters: rows are bucketed by nearest centroid and a
+# query only scans the buckets of its NPROBE nearest centroids. NPROBE 16 reaches
+# recall@10 1.000 (0.99 at 8) on helper/bench_similar.py's overlapping clusters.
+NPROBE = 16
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLES_PER_LIST = 40
+INITIAL_CAPACITY = 1024
+BRUTE_FORCE_CHUNK = 16384  # Rows scored at a time by the brute-force scan and train()
+# When train_in_background() re-clusters: once an untrained index outgrows a
+# brute-force scan, or rows added since the last train() outgrow this share
+MIN_TRAIN_ROWS = 10_000
+RETRAIN_TAIL_FRACTION = 0.25
+# Cosine similarity at which two embeddings count as the same image
+# (/analyze's duplicate_of and helper/dedup_dataset.py)
+EMBEDDING_DUPLICATE_SIMILARITY = 0.97
+
+
+def normalize(vectors):
+    """L2-normalize rows in float32; zero vectors stay zero"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def kmeans(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    """Spherical k-means on normalized float32 rows, returning unit centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        empty = np.bincount(assignments, minlength=nlist) == 0
+        # Re-seed empty lists from random rows so every centroid stays in use
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class EmbeddingIndex:
+    """Cosine nearest-neighbour index over L2-normalized float32 embeddings
+
+    The index lives in one directory that several processes (gunicorn
+    workers) can share; writes are serialized with a file lock and every
+    process picks up the others' rows on its next query.
+
+        vectors.npy    float32 (capacity, dim), memory-mapped, rows [0, count) live
+        lists.npy      int32 (capacity,), IVF list of each row, -1 while untrained
+        centroids.npy  float32 (nlist, dim), written by train()
+        offsets.npy    int64 (nlist + 1,), written by train()
+        meta.jsonl     one JSON object per row; its line count is the row count
+
+    train() rewrites the rows grouped by IVF list, so list i is the contiguous
+    slice offsets[i]:offsets[i + 1] and a probe scores a mapped slice in place;
+    float32 rather than float16 storage means no per-query conversion, and the
+    page cache holding it is shared by every worker. Rows added later are
+    appended after offsets[-1] and scanned individually until the next train().
+    Until the first train() queries fall back to a brute-force scan.
+    helper/build_index.py trains after a bulk load; the app calls
+    train_in_background() after each add, which re-clusters once the index
+    reaches MIN_TRAIN_ROWS or the untrained tail RETRAIN_TAIL_FRACTION.
+    """
+
+    def __init__(self, path, dim):
+        self.path = path
+        self.dim = dim
+        os.makedirs(path, exist_ok=True)
+        self._vectors_path = os.path.join(path, 'vectors.npy')
+        self._lists_path = os.path.join(path, 'lists.npy')
+        self._centroids_path = os.path.join(path, 'centroids.npy')
+        self._offsets_path = os.path.join(path, 'offsets.npy')
+        self._meta_path = os.path.join(path, 'meta.jsonl')
+        self._lock_path = os.path.join(path, 'lock')
+        self._thread_lock = threading.RLock()
+        self._training = None
+
+        if not os.path.exists(self._vectors_path):
+            np.lib.format.open_memmap(self._vectors_path, mode='w+', dtype=np.float32,
+                                      shape=(INITIAL_CAPACITY, dim)).flush()
+            np.lib.format.open_memmap(self._lists_path, mode='w+', dtype=np.int32,
+                                      shape=(INITIAL_CAPACITY,))[:] = -1
+            open(self._meta_path, 'a').close()
+
+        self._centroids_mtime = None
+        self._reset()
+        self.refresh()
+
+    def __len__(self):
+        return self.count
+
+    def _reset(self):
+        """Forget every row, so the next refresh() reads the index from scratch"""
+        self.count = 0
+        self.meta = []
+        self.ids = {}
+        self._meta_offset = 0
+        self.centroids = None
+        self.offsets = None
+        self._tail_lists = {}
+        self._open_arrays()
+
+    def _open_arrays(self):
+        self.vectors = np.load(self._vectors_path, mmap_mode='r+')
+        self.lists = np.load(self._lists_path, mmap_mode='r+')
+        if self.vectors.shape[1] != self.dim:
+            raise ValueError(f"Index at {self.path} stores {self.vectors.shape[1]}-d vectors, expected {self.dim}")
+        if self.vectors.dtype != np.float32:
+            raise ValueError(f"Index at {self.path} stores {self.vectors.dtype} vectors; "
+                             f"rebuild it with helper/build_index.py")
+
+    def _file_lock(self, mode=fcntl.LOCK_EX):
+        lock_file = open(self._lock_path, 'a')
+        fcntl.flock(lock_file, mode)
+        return lock_file
+
+    def _centroids_changed(self):
+        mtime = os.path.getmtime(self._centroids_path) if os.path.exists(self._centroids_path) else None
+        return mtime != self._centroids_mtime
+
+    def refresh(self, locked=False):
+        """Pick up rows, and whole re-trained layouts, written by other processes"""
+        with self._thread_lock:
+            if os.path.getsize(self._meta_path) == self._meta_offset and not self._centroids_changed():
+                return
+            # train() replaces every file; hold the lock so we never read half of one layout
+            lock_file = None if locked else self._file_lock(fcntl.LOCK_SH)
+            try:
+                if self._centroids_changed():
+                    self._reset()
+                    self._load_layout()
+                self._read_new_rows()
+            finally:
+                if lock_file is not None:
+                    lock_file.close()
+
+    def _load_layout(self):
+        if not os.path.exists(self._centroids_path):
+            self._centroids_mtime = None
+            return
+        self._centroids_mtime = os.path.getmtime(self._centroids_path)
+        self.centroids = np.load(self._centroids_path)
+        self.offsets = np.load(self._offsets_path)
+
+    def _read_new_rows(self):
+        with open(self._meta_path, 'rb') as meta_file:
+            meta_file.seek(self._meta_offset)
+            new_rows = []
+            for line in meta_file:
+                if not line.endswith(b'\n'):
+                    break  # Another process is mid-append; read it next time
+                new_rows.append(json.loads(line))
+                self._meta_offset += len(line)
+
+        start = self.count
+        self.count += len(new_rows)
+        for row, record in enumerate(new_rows, start):
+            self.meta.append(record)
+            self.ids[record['id']] = row
+        # Another process may have grown (replaced) the files since we mapped them
+        if self.count > len(self.vectors):
+            self._open_arrays()
+        if self.centroids is not None:
+            for row in range(max(start, int(self.offsets[-1])), self.count):
+                self._tail_lists.setdefault(int(self.lists[row]), []).append(row)
+
+    def _grow(self, capacity):
+        for path, shape, fill in ((self._vectors_path, (capacity, self.dim), 0),
+                                  (self._lists_path, (capacity,), -1)):
+            old = np.load(path, mmap_mode='r')
+            tmp_path = path + '.tmp.npy'
+            new = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=old.dtype, shape=shape)
+            new[:len(old)] = old
+            new[len(old):] = fill
+            new.flush()
+            del new, old
+            os.replace(tmp_path, path)
+        self._open_arrays()
+
+    def _assign(self, vectors):
+        return np.argmax(vectors @ self.centroids.T, axis=1).astype(np.int32)
+
+    def add(self, vectors, records):
+        """Append embeddings with one metadata dict (holding a unique 'id') per row"""
+        vectors = normalize(np.atleast_2d(vectors))
+        if len(vectors) != len(records):
+            raise ValueError("Need exactly one metadata record per vector")
+
+        with self._thread_lock:
+            lock_file = self._file_lock()
+            try:
+                self.refresh(locked=True)
+                start, end = self.count, self.count + len(vectors)
+                if end > len(self.vectors):
+                    self._grow(max(end, 2 * len(self.vectors)))
+
+                self.vectors[start:end] = vectors
+                self.lists[start:end] = self._assign(vectors) if self.centroids is not None else -1
+                self.vectors.flush()
+                self.lists.flush()
+                with open(self._meta_path, 'ab') as meta_file:
+                    meta_file.write(b''.join(json.dumps(record).encode() + b'\n' for record in records))
+                self.refresh(locked=True)
+            finally:
+                lock_file.close()
+
+    def needs_training(self):
+        """Whether queries would get faster from (re-)clustering the current rows"""
+        if self.centroids is None:
+            return self.count >= MIN_TRAIN_ROWS
+        trained = int(self.offsets[-1])
+        return self.count - trained > RETRAIN_TAIL_FRACTION * trained
+
+    def train_in_background(self):
+        """Start train() in a daemon thread if the index needs it and none is running here
+
+        Clustering runs without any lock; only the final rewrite holds the
+        index lock, during which other processes' refresh() waits. When
+        several workers start at once, the later ones find it done and return.
+        """
+        if not self.needs_training() or (self._training is not None and self._training.is_alive()):
+            return
+
+        def run():
+            try:
+                self.train(if_needed=True)
+            except Exception as e:
+                logging.error(f"Background training of the similarity index failed: {e}")
+
+        self._training = threading.Thread(target=run, name='similarity-train', daemon=True)
+        self._training.start()
+
+    def train(self, nlist=None, seed=0, if_needed=False):
+        """Cluster the current rows into IVF lists and rewrite them grouped by list"""
+        self.refresh()
+        with self._thread_lock:
+            vectors, count = self.vectors, self.count
+        if count == 0:
+            raise ValueError("Cannot train an empty index")
+        nlist = min(nlist or max(1, int(np.sqrt(count))), count)
+
+        # Rows [0, count) never change in place, so cluster them without holding any lock
+        rng = np.random.default_rng(seed)
+        sample_size = min(count, nlist * KMEANS_SAMPLES_PER_LIST)
+        sample = np.sort(rng.choice(count, sample_size, replace=False))
+        centroids = kmeans(np.asarray(vectors[sample]), nlist, seed=seed)
+
+        with self._thread_lock:
+            lock_file = self._file_lock()
+            try:
+                self.refresh(locked=True)
+                if if_needed and not self.needs_training():
+                    return  # Another process trained meanwhile
+                self.centroids = centroids
+                assignments = np.empty(self.count, dtype=np.int32)
+                for start in range(0, self.count, BRUTE_FORCE_CHUNK):
+                    end = min(start + BRUTE_FORCE_CHUNK, self.count)
+                    assignments[start:end] = self._assign(self.vectors[start:end])
+                order = np.argsort(assignments, kind='stable')
+                offsets = np.searchsorted(assignments[order], np.arange(nlist + 1)).astype(np.int64)
+                self._write_grouped(order, assignments[order], offsets)
+                self._reset()
+                self._load_layout()
+                self._read_new_rows()
+            finally:
+                lock_file.close()
+        logging.info(f"Trained similarity index: {self.count} rows in {nlist} lists")
+
+    def _write_grouped(self, order, lists, offsets):
+        """Replace every file with the rows in `order`; centroids.npy goes last and marks the new layout"""
+        vectors_tmp = self._vectors_path + '.tmp.npy'
+        vectors = np.lib.format.open_memmap(vectors_tmp, mode='w+', dtype=np.float32, shape=self.vectors.shape)
+        for start in range(0, self.count, BRUTE_FORCE_CHUNK):
+            rows = order[start:start + BRUTE_FORCE_CHUNK]
+            vectors[start:start + len(rows)] = self.vectors[rows]
+        vectors.flush()
+        del vectors
+
+        lists_tmp = self._lists_path + '.tmp.npy'
+        all_lists = np.full(len(self.lists), -1, dtype=np.int32)
+        all_lists[:self.count] = lists
+        np.save(lists_tmp, all_lists)
+
+        with open(self._meta_path, 'rb') as meta_file:
+            lines = meta_file.read(self._meta_offset).splitlines(keepends=True)
+        meta_tmp = self._meta_path + '.tmp'
+        with open(meta_tmp, 'wb') as meta_file:
+            meta_file.writelines(lines[row] for row in order)
+
+        offsets_tmp = self._offsets_path + '.tmp.npy'
+        np.save(offsets_tmp, offsets)
+        centroids_tmp = self._centroids_path + '.tmp.npy'
+        np.save(centroids_tmp, self.centroids)
+
+        for tmp_path, path in ((vectors_tmp, self._vectors_path), (lists_tmp, self._lists_path),
+                               (meta_tmp, self._meta_path), (offsets_tmp, self._offsets_path),
+                               (centroids_tmp, self._centroids_path)):
+            os.replace(tmp_path, path)
+
+    def _scores(self, query, nprobe):
+        """(rows, similarities) of the rows a query scans"""
+        if self.centroids is None:
+            scores = np.concatenate([
+                self.vectors[start:min(start + BRUTE_FORCE_CHUNK, self.count)] @ query
+                for start in range(0, self.count, BRUTE_FORCE_CHUNK)
+            ]) if self.count else np.empty(0, dtype=np.float32)
+            return np.arange(self.count), scores
+
+        probed = np.argsort(self.centroids @ query)[::-1][:nprobe]
+        rows, scores = [], []
+        for list_id in probed:
+            start, end = self.offsets[list_id], self.offsets[list_id + 1]
+            rows.append(np.arange(start, end))
+            scores.append(self.vectors[start:end] @ query)
+            tail = self._tail_lists.get(int(list_id))
+            if tail:
+                rows.append(np.asarray(tail))
+                scores.append(self.vectors[tail] @ query)
+        return np.concatenate(rows), np.concatenate(scores)
+
+    def search(self, vector, k=5, nprobe=NPROBE, exclude=()):
+        """Return up to k (similarity, metadata) pairs, most similar first"""
+        self.refresh()
+        query = normalize(vector).ravel()
+        with self._thread_lock:
+            rows, scores = self._scores(query, nprobe)
+            top = min(k + len(exclude), len(rows))
+            if top == 0:
+                return []
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best])]
+            results = [(float(scores[i]), self.meta[rows[i]]) for i in best
+                       if self.meta[rows[i]]['id'] not in exclude]
+        return results[:k]
+
+    def vector(self, record_id):
+        """Stored (normalized) embedding of a row, or None for an unknown id"""
+        self.refresh()
+        with self._thread_lock:
+            row = self.ids.get(record_id)
+            return None if row is None else np.array(self.vectors[row])
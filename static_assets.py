@@ -0,0 +1,92 @@
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+from flask import request, abort
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+    logging.warning("brotli not installed, static files are precompressed with gzip only")
+
+# Versioned URLs never change content, so browsers may keep them for a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Unversioned URLs and pages are revalidated with their ETag on every use
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+MIN_COMPRESS_SIZE = 512  # Not worth a Content-Encoding below this
+MAX_COMPRESSED_RATIO = 0.9  # Keep an encoding only if it saves at least 10%
+
+
+def build_asset(body, mimetype):
+    """Hash and precompress a response body once, at startup"""
+    variants = {}
+    if len(body) >= MIN_COMPRESS_SIZE:
+        candidates = {'gzip': gzip.compress(body, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            candidates['br'] = brotli.compress(body, quality=11)
+        # Already-compressed formats such as PNG rarely shrink; keep only real savings
+        variants = {encoding: data for encoding, data in candidates.items()
+                    if len(data) <= len(body) * MAX_COMPRESSED_RATIO}
+
+    return {
+        'body': body,
+        'mimetype': mimetype,
+        'version': hashlib.sha256(body).hexdigest()[:12],
+        'variants': variants,
+    }
+
+
+def load_static_assets(static_folder):
+    """Read every file under static_folder into memory, keyed by its URL filename"""
+    assets = {}
+    for root, _, files in os.walk(static_folder):
+        for name in files:
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            with open(path, 'rb') as file:
+                assets[filename] = build_asset(file.read(), mimetype)
+    return assets
+
+
+def asset_response(response_class, asset, immutable=False):
+    """Serve the best encoding the client accepts, answering 304 on a matching ETag"""
+    encoding = None
+    for candidate in ('br', 'gzip'):
+        if candidate in asset['variants'] and request.accept_encodings[candidate]:
+            encoding = candidate
+            break
+
+    body = asset['variants'][encoding] if encoding else asset['body']
+    response = response_class(body, mimetype=asset['mimetype'])
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if asset['variants']:
+        response.vary.add('Accept-Encoding')
+    response.set_etag(f"{asset['version']}-{encoding or 'identity'}")
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+    return response.make_conditional(request)
+
+
+def init_app(app):
+    """Serve app.static_folder from memory with content-hashed URLs"""
+    assets = load_static_assets(app.static_folder)
+    logging.info(f"Loaded {len(assets)} static assets")
+
+    @app.url_defaults
+    def add_static_version(endpoint, values):
+        if endpoint == 'static' and 'v' not in values:
+            asset = assets.get(values.get('filename'))
+            if asset is not None:
+                values['v'] = asset['version']
+
+    def serve_static(filename):
+        asset = assets.get(filename)
+        if asset is None:
+            abort(404)
+        return asset_response(app.response_class, asset, immutable=request.args.get('v') == asset['version'])
+
+    app.view_functions['static'] = serve_static
+    return assets
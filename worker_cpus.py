@@ -0,0 +1,37 @@
+import os
+
+# Splits the CPUs this process may run on into one contiguous group per
+# gunicorn worker, so each worker's TensorFlow pools stay on their own cores.
+# Kept free of heavy imports: gunicorn.conf.py loads it in the master process.
+
+
+def available_cpus():
+    """CPU ids this process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def cpu_groups(workers, cpus=None):
+    """Partition cpus into `workers` near-equal contiguous groups; workers share CPUs when outnumbering them"""
+    cpus = available_cpus() if cpus is None else cpus
+    if workers >= len(cpus):
+        return [[cpus[slot % len(cpus)]] for slot in range(workers)]
+    base, extra = divmod(len(cpus), workers)
+    groups, start = [], 0
+    for slot in range(workers):
+        size = base + (1 if slot < extra else 0)
+        groups.append(cpus[start:start + size])
+        start += size
+    return groups
+
+
+def pin_worker(slot, workers, cpus=None):
+    """Restrict the calling process to its group; returns the group, or None where unsupported"""
+    if not hasattr(os, 'sched_setaffinity'):
+        return None
+    group = cpu_groups(workers, cpus)[slot % workers]
+    os.sched_setaffinity(0, group)
+    # predict.py sizes TensorFlow's thread pools from this
+    os.environ['WORKER_CPUS'] = str(len(group))
+    return group